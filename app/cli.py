@@ -5,30 +5,43 @@ A console-based interface for the proof-of-work voting system.
 """
 
 import hashlib
+import secrets
+from collections import Counter
 from datetime import datetime, timezone
-from typing import Dict
+from typing import Tuple
 
-from sqlmodel import select
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import bindparam, exists, func, insert, select
 from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
 from rich.table import Table
-from rich.progress import (
-    Progress,
-    SpinnerColumn,
-    TextColumn,
-    BarColumn,
-    TaskProgressColumn,
-    TimeElapsedColumn,
-)
 from rich.prompt import Prompt
 from rich.align import Align
 from rich import box
 
 from .models import Block
 from .database import create_db_and_tables, get_session_direct
-from .pow import compute_nonce, verify_pow, hash_block, get_difficulty_target
-from .sql_functions import get_sql_manager
+from .pow import (
+    compute_nonce_parallel,
+    encode_prefix,
+    verify_pow,
+    hash_block,
+    get_difficulty_target,
+    shutdown_pool,
+)
+
+# Number of blocks shown per page of the audit log
+AUDIT_PAGE_SIZE = 50
+
+# Columns SQLite reports when the unique_vote constraint is violated
+UNIQUE_VOTE_COLUMNS = "blocks.poll_id, blocks.voter_hash"
+
+
+def _voter_hash(voter_id: str) -> str:
+    """Return the hex SHA-256 hash identifying a voter."""
+    # Not cached: a cache would keep raw voter IDs in memory
+    return hashlib.sha256(voter_id.encode("utf-8")).hexdigest()
 
 
 class HashVoteCLI:
@@ -38,6 +51,10 @@ class HashVoteCLI:
         """Initialize CLI application."""
         self.session = None
         self.console = Console()
+        # Header and menu never change, so they are built once and
+        # reprinted on every pass of the main loop
+        self._header_panel = self._build_header_panel()
+        self._menu_panel = self._build_menu_panel()
         self.setup_database()
 
     def setup_database(self):
@@ -45,12 +62,33 @@ class HashVoteCLI:
         create_db_and_tables()
         self.session = get_session_direct()
 
+        # Core INSERT built once; RETURNING gives the new id without a
+        # follow-up SELECT
+        self._insert_block_stmt = insert(Block).returning(Block.id)
+
+        # Statements used on every vote are built once with bound
+        # parameters, so only the values change between executions
+        same_vote = (
+            Block.poll_id == bindparam("poll_id"),
+            Block.voter_hash == bindparam("voter_hash"),
+        )
+        self._latest_hash_stmt = (
+            select(Block.block_hash)
+            .where(Block.poll_id == bindparam("poll_id"))
+            .order_by(Block.id.desc())
+            .limit(1)
+        )
+        self._vote_context_stmt = select(
+            exists().where(*same_vote),
+            self._latest_hash_stmt.scalar_subquery(),
+        )
+
     def clear_screen(self):
         """Clear console screen."""
         self.console.clear()
 
-    def display_header(self):
-        """Display application header."""
+    def _build_header_panel(self) -> Panel:
+        """Build the application header panel."""
         title = Text("HashVote", style="bold cyan")
         subtitle = Text("Proof of Work Based Voting System", style="white")
 
@@ -60,18 +98,15 @@ class HashVoteCLI:
         header_text.append("  🔗\n", style="yellow")
         header_text.append(subtitle)
 
-        header_panel = Panel(
+        return Panel(
             Align.center(header_text),
             box=box.DOUBLE,
             border_style="cyan",
             padding=(1, 2),
         )
 
-        self.console.print(header_panel)
-        self.console.print()
-
-    def display_menu(self):
-        """Display main menu options."""
+    def _build_menu_panel(self) -> Panel:
+        """Build the main menu panel."""
         menu_table = Table(
             show_header=False,
             box=box.SIMPLE_HEAD,
@@ -93,7 +128,7 @@ class HashVoteCLI:
         for num, icon, desc in menu_items:
             menu_table.add_row(num, icon, desc)
 
-        menu_panel = Panel(
+        return Panel(
             menu_table,
             title="📋 メニュー",
             title_align="left",
@@ -101,34 +136,38 @@ class HashVoteCLI:
             padding=(1, 2),
         )
 
-        self.console.print(menu_panel)
+    def display_header(self):
+        """Display application header."""
+        self.console.print(self._header_panel)
+        self.console.print()
+
+    def display_menu(self):
+        """Display main menu options."""
+        self.console.print(self._menu_panel)
 
     def get_user_input(self, prompt: str) -> str:
         """Get user input with prompt."""
         return Prompt.ask(f"[bold cyan]{prompt}[/bold cyan]").strip()
 
-    def get_latest_block_hash(self, poll_id: str) -> str:
-        """Get the hash of the latest block for a given poll."""
-        statement = (
-            select(Block)
-            .where(Block.poll_id == poll_id)
-            .order_by(Block.id.desc())
-            .limit(1)
-        )
-        latest_block = self.session.exec(statement).first()
+    def get_vote_context(
+        self, poll_id: str, voter_hash: str
+    ) -> Tuple[bool, str]:
+        """
+        Check for a duplicate vote and get the previous block hash.
 
-        if latest_block:
-            return latest_block.block_hash
-        else:
-            return "0" * 64
+        Both lookups run as one SELECT with two scalar subqueries.
 
-    def check_duplicate_vote(self, poll_id: str, voter_hash: str) -> bool:
-        """Check if voter has already voted in this poll."""
-        statement = select(Block).where(
-            Block.poll_id == poll_id, Block.voter_hash == voter_hash
-        )
-        existing_vote = self.session.exec(statement).first()
-        return existing_vote is not None
+        Returns:
+            Tuple of (already voted, previous block hash)
+        """
+        is_duplicate, block_hash = self.session.exec(
+            self._vote_context_stmt,
+            params={"poll_id": poll_id, "voter_hash": voter_hash},
+        ).one()
+
+        # Always chain onto the hash just read, never a cached one, so a
+        # block written elsewhere cannot fork the chain
+        return bool(is_duplicate), block_hash or "0" * 64
 
     def handle_vote(self):
         """Handle voting process."""
@@ -152,19 +191,23 @@ class HashVoteCLI:
             return
 
         # Generate voter hash
-        voter_hash = hashlib.sha256(voter_id.encode("utf-8")).hexdigest()
+        voter_hash = _voter_hash(voter_id)
 
-        # Check for duplicate vote
-        if self.check_duplicate_vote(poll_id, voter_hash):
+        # Check for duplicate vote and get previous hash
+        is_duplicate, prev_hash = self.get_vote_context(poll_id, voter_hash)
+        if is_duplicate:
             self.console.print(
                 "[red]❌ エラー: この投票者は既に投票済みです[/red]"
             )
             return
 
-        # Get previous hash
-        prev_hash = self.get_latest_block_hash(poll_id)
         timestamp = datetime.now(timezone.utc)
 
+        # Encode the fixed block fields once for mining and verification
+        prefix = encode_prefix(
+            poll_id, voter_hash, choice, timestamp, prev_hash
+        )
+
         # Display proof of work information
         difficulty_target = get_difficulty_target()
         difficulty = 6 if poll_id.startswith("test_") else 18
@@ -181,28 +224,58 @@ class HashVoteCLI:
         )
         self.console.print(pow_panel)
 
-        # Compute nonce with progress bar
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
-            BarColumn(),
-            TaskProgressColumn(),
-            TimeElapsedColumn(),
-            console=self.console,
-        ) as progress:
-            pow_task = progress.add_task("[cyan]🔍 Nonce計算中...", total=None)
-
-            nonce = compute_nonce(
-                poll_id,
-                voter_hash,
-                choice,
-                timestamp,
-                prev_hash,
-                difficulty_bits=difficulty,
-                timeout=30.0,
-            )
+        # Compute nonce with progress bar; rich.progress is only needed
+        # here, so it is imported on first vote rather than at startup
+        from rich.progress import (
+            Progress,
+            SpinnerColumn,
+            TextColumn,
+            BarColumn,
+            TaskProgressColumn,
+            TimeElapsedColumn,
+        )
 
-            progress.update(pow_task, completed=100, total=100)
+        try:
+            with Progress(
+                SpinnerColumn(),
+                TextColumn("[progress.description]{task.description}"),
+                BarColumn(),
+                TaskProgressColumn(),
+                TimeElapsedColumn(),
+                console=self.console,
+            ) as progress:
+                # A valid nonce takes 2^difficulty attempts on average
+                expected_attempts = 2**difficulty
+                pow_task = progress.add_task(
+                    "[cyan]🔍 Nonce計算中...", total=expected_attempts
+                )
+
+                nonce = compute_nonce_parallel(
+                    poll_id,
+                    voter_hash,
+                    choice,
+                    timestamp,
+                    prev_hash,
+                    difficulty_bits=difficulty,
+                    timeout=30.0,
+                    prefix=prefix,
+                    start_nonce=secrets.randbits(63),
+                    progress=lambda count: progress.update(
+                        pow_task, advance=count
+                    ),
+                )
+
+                progress.update(pow_task, completed=expected_attempts)
+        except Exception as e:
+            # A crashed worker or broken pool ends this vote, not the
+            # whole session
+            error_panel = Panel(
+                f"❌ エラー: {str(e)}",
+                title="[red]Nonce計算エラー[/red]",
+                border_style="red",
+            )
+            self.console.print(error_panel)
+            return
 
         if nonce is None:
             self.console.print(
@@ -219,6 +292,7 @@ class HashVoteCLI:
             prev_hash,
             nonce,
             difficulty_bits=difficulty,
+            prefix=prefix,
         ):
             self.console.print(
                 "[red]❌ エラー: Proof of Work検証に失敗しました[/red]"
@@ -227,30 +301,37 @@ class HashVoteCLI:
 
         # Calculate block hash
         block_hash = hash_block(
-            poll_id, voter_hash, choice, timestamp, prev_hash, nonce
+            poll_id,
+            voter_hash,
+            choice,
+            timestamp,
+            prev_hash,
+            nonce,
+            prefix=prefix,
         )
 
         # Save vote to database
         try:
-            block = Block(
-                poll_id=poll_id,
-                voter_hash=voter_hash,
-                choice=choice,
-                timestamp=timestamp,
-                prev_hash=prev_hash,
-                nonce=nonce,
-                block_hash=block_hash,
-            )
-
-            self.session.add(block)
+            row = self.session.exec(
+                self._insert_block_stmt,
+                params={
+                    "poll_id": poll_id,
+                    "voter_hash": voter_hash,
+                    "choice": choice,
+                    "timestamp": timestamp,
+                    "prev_hash": prev_hash,
+                    "nonce": nonce,
+                    "block_hash": block_hash,
+                },
+            ).one()
             self.session.commit()
-            self.session.refresh(block)
+            block_id = row[0]
 
             # Display success message in a beautiful panel
             success_table = Table(show_header=False, box=box.SIMPLE)
             success_table.add_column("項目", style="green bold")
             success_table.add_column("値", style="white")
-            success_table.add_row("🆔 ブロックID", str(block.id))
+            success_table.add_row("🆔 ブロックID", str(block_id))
             success_table.add_row(
                 "🔗 ブロックハッシュ", f"{block_hash[:32]}..."
             )
@@ -264,6 +345,20 @@ class HashVoteCLI:
             )
             self.console.print(success_panel)
 
+        except IntegrityError as e:
+            self.session.rollback()
+            # The unique_vote constraint rejects a vote that slipped past
+            # get_vote_context, e.g. one saved concurrently. SQLite names
+            # the columns rather than the constraint, so match on those;
+            # any other constraint failure is a plain save error
+            if UNIQUE_VOTE_COLUMNS in str(e.orig):
+                self.console.print(
+                    "[red]❌ エラー: この投票者は既に投票済みです[/red]"
+                )
+            else:
+                self.console.print(
+                    f"[red]❌ エラー: 投票の保存に失敗しました: {str(e)}[/red]"
+                )
         except Exception as e:
             self.session.rollback()
             self.console.print(
@@ -280,22 +375,21 @@ class HashVoteCLI:
             self.console.print("[red]❌ エラー: 投票IDが必要です[/red]")
             return
 
-        # Get all votes for the poll
-        statement = select(Block).where(Block.poll_id == poll_id)
-        blocks = self.session.exec(statement).all()
+        # Count votes by choice in the database
+        statement = (
+            select(Block.choice, func.count())
+            .where(Block.poll_id == poll_id)
+            .group_by(Block.choice)
+        )
+        choice_counts = Counter(dict(self.session.exec(statement).all()))
 
-        if not blocks:
+        if not choice_counts:
             self.console.print(
                 f"[yellow]⚠️ 投票ID '{poll_id}' の投票は見つかりませんでした[/yellow]"
             )
             return
 
-        # Count votes by choice
-        choice_counts: Dict[str, int] = {}
-        for block in blocks:
-            choice_counts[block.choice] = (
-                choice_counts.get(block.choice, 0) + 1
-            )
+        total_votes = sum(choice_counts.values())
 
         # Create results table
         results_table = Table(
@@ -308,14 +402,10 @@ class HashVoteCLI:
         results_table.add_column("グラフ", style="blue")
 
         # Sort by vote count (descending)
-        sorted_choices = sorted(
-            choice_counts.items(),
-            key=lambda x: x[1],
-            reverse=True,
-        )
+        sorted_choices = choice_counts.most_common()
 
         for choice, count in sorted_choices:
-            percentage = (count / len(blocks)) * 100
+            percentage = (count / total_votes) * 100
             bar_length = int(percentage / 5)  # Scale bar to fit
             bar = "█" * bar_length + "░" * (20 - bar_length)
 
@@ -328,7 +418,7 @@ class HashVoteCLI:
 
         # Summary info
         summary_panel = Panel(
-            f"📈 総投票数: [bold]{len(blocks)}[/bold]票\n"
+            f"📈 総投票数: [bold]{total_votes}[/bold]票\n"
             f"🏆 最多得票: [bold]{sorted_choices[0][0]}[/bold] "
             f"({sorted_choices[0][1]}票)",
             title="統計情報",
@@ -348,13 +438,15 @@ class HashVoteCLI:
             self.console.print("[red]❌ エラー: 投票IDが必要です[/red]")
             return
 
-        # Get all blocks in order
-        statement = (
-            select(Block).where(Block.poll_id == poll_id).order_by(Block.id)
+        # Count blocks first so rows can be streamed afterwards
+        count_statement = (
+            select(func.count())
+            .select_from(Block)
+            .where(Block.poll_id == poll_id)
         )
-        blocks = self.session.exec(statement).all()
+        block_count = self.session.exec(count_statement).one()
 
-        if not blocks:
+        if not block_count:
             self.console.print(
                 f"[yellow]⚠️ 投票ID '{poll_id}' の投票は見つかりませんでした[/yellow]"
             )
@@ -363,35 +455,64 @@ class HashVoteCLI:
         # Header with summary
         header_panel = Panel(
             f"📋 監査ログ (投票ID: [bold]{poll_id}[/bold])\n"
-            f"🧱 総ブロック数: [bold]{len(blocks)}[/bold]",
+            f"🧱 総ブロック数: [bold]{block_count}[/bold]",
             title="監査情報",
             border_style="blue",
         )
         self.console.print(header_panel)
 
-        # Create blocks table
-        blocks_table = Table(box=box.ROUNDED, title="🔗 ブロックチェーン詳細")
-        blocks_table.add_column("#", style="cyan bold", width=4)
-        blocks_table.add_column("ID", style="blue", width=6)
-        blocks_table.add_column("投票者", style="yellow", width=18)
-        blocks_table.add_column("選択肢", style="green bold", width=12)
-        blocks_table.add_column("タイムスタンプ", style="white", width=20)
-        blocks_table.add_column("Nonce", style="magenta", width=10)
-        blocks_table.add_column("ハッシュ", style="cyan", width=18)
-
-        for i, block in enumerate(blocks, 1):
-            timestamp_str = block.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            blocks_table.add_row(
-                str(i),
-                str(block.id),
-                f"{block.voter_hash[:16]}...",
-                block.choice,
-                timestamp_str,
-                str(block.nonce),
-                f"{block.block_hash[:16]}...",
+        # Stream blocks in order without materializing the whole chain
+        # Only the displayed columns are selected
+        statement = (
+            select(
+                Block.id,
+                Block.voter_hash,
+                Block.choice,
+                Block.timestamp,
+                Block.nonce,
+                Block.block_hash,
             )
+            .where(Block.poll_id == poll_id)
+            .order_by(Block.id)
+            .execution_options(yield_per=500)
+        )
+        # Closing the result releases the cursor even if paging stops
+        # early or rendering raises
+        with self.session.exec(statement) as rows:
+            # Show the chain one page at a time; later pages are only read
+            # from the cursor if the user asks for them
+            blocks_table = self._create_audit_table()
+            for i, row in enumerate(rows, 1):
+                block_id, voter_hash, choice, timestamp, nonce, block_hash = (
+                    row
+                )
+                timestamp_str = timestamp.isoformat(
+                    sep=" ", timespec="seconds"
+                )
+                blocks_table.add_row(
+                    str(i),
+                    str(block_id),
+                    f"{voter_hash[:6]}…",
+                    choice,
+                    timestamp_str,
+                    str(nonce),
+                    # Leading digits are the PoW zeros; the tail tells
+                    # blocks apart
+                    f"…{block_hash[-6:]}",
+                )
+
+                if i % AUDIT_PAGE_SIZE == 0 and i < block_count:
+                    self.console.print(blocks_table)
+                    blocks_table = None
+                    answer = self.get_user_input(
+                        f"次の{AUDIT_PAGE_SIZE}件を表示しますか？ (y/N)"
+                    )
+                    if answer.lower() != "y":
+                        break
+                    blocks_table = self._create_audit_table()
 
-        self.console.print(blocks_table)
+        if blocks_table is not None:
+            self.console.print(blocks_table)
 
         # Chain integrity info
         integrity_panel = Panel(
@@ -402,6 +523,25 @@ class HashVoteCLI:
         )
         self.console.print(integrity_panel)
 
+    def _create_audit_table(self) -> Table:
+        """Create an empty table for one page of the audit log."""
+        # Columns are sized by Rich so the table fits an 80-column
+        # terminal; choice and timestamp wrap before ID or Nonce shrink
+        blocks_table = Table(
+            box=box.ROUNDED, title="🔗 ブロックチェーン詳細", pad_edge=False
+        )
+        blocks_table.add_column("#", style="cyan bold", no_wrap=True)
+        blocks_table.add_column("ID", style="blue", no_wrap=True)
+        blocks_table.add_column("投票者", style="yellow", no_wrap=True)
+        blocks_table.add_column("選択肢", style="green bold")
+        blocks_table.add_column("タイムスタンプ", style="white", min_width=10)
+        # Random 63-bit start nonces print as up to 19 digits
+        blocks_table.add_column(
+            "Nonce", style="magenta", no_wrap=True, min_width=19
+        )
+        blocks_table.add_column("ハッシュ", style="cyan", no_wrap=True)
+        return blocks_table
+
     def handle_health_check(self):
         """Handle health check display."""
         self.console.rule("[bold magenta]💚 ヘルスチェック[/bold magenta]")
@@ -412,8 +552,8 @@ class HashVoteCLI:
             self.session.exec(statement).first()
 
             # Get total number of blocks
-            statement = select(Block)
-            all_blocks = self.session.exec(statement).all()
+            statement = select(func.count(Block.id))
+            total_blocks = self.session.exec(statement).one()
 
             # Create health status table
             health_table = Table(show_header=False, box=box.SIMPLE)
@@ -421,7 +561,7 @@ class HashVoteCLI:
             health_table.add_column("ステータス", style="green")
 
             health_table.add_row("🔗 データベース接続", "✅ 正常")
-            health_table.add_row("🧱 総ブロック数", f"{len(all_blocks)}")
+            health_table.add_row("🧱 総ブロック数", f"{total_blocks}")
             health_table.add_row(
                 "⏰ 現在時刻",
                 datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC"),
@@ -496,6 +636,8 @@ class HashVoteCLI:
         choice = self.get_user_input("機能を選択してください (1-7)")
 
         try:
+            from .sql_functions import get_sql_manager
+
             sql_manager = get_sql_manager()
 
             if choice == "1":
@@ -598,7 +740,7 @@ class HashVoteCLI:
         query = " ".join(query_lines)
 
         try:
-            results = sql_manager.execute_query(query)
+            results = sql_manager.execute_query(query, as_dict=False)
 
             if results:
                 if len(results) > 0:
@@ -613,10 +755,14 @@ class HashVoteCLI:
                             result_table.add_column(key, style="white")
 
                         # Add rows (limit to first 50 for display)
-                        for row in results[:50]:
-                            result_table.add_row(
-                                *[str(value) for value in row.values()]
-                            )
+                        # Cells are stringified up front; Rich measures
+                        # column widths once when the table is printed
+                        display_rows = [
+                            [str(value) for value in row]
+                            for row in results[:50]
+                        ]
+                        for values in display_rows:
+                            result_table.add_row(*values)
 
                     self.console.print(result_table)
 
@@ -766,7 +912,7 @@ class HashVoteCLI:
         """
 
         try:
-            results = sql_manager.execute_query(query)
+            results = sql_manager.execute_query(query, as_dict=False)
 
             if results:
                 behavior_table = Table(
@@ -830,6 +976,7 @@ class HashVoteCLI:
         finally:
             if self.session:
                 self.session.close()
+            shutdown_pool()
 
 
 def main():
@@ -2,6 +2,8 @@
 Database configuration and session management for HashVote.
 """
 
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
 from sqlmodel import SQLModel, create_engine, Session
 from typing import Generator
 
@@ -16,8 +18,34 @@ engine = create_engine(
     connect_args={
         "check_same_thread": False
     },  # Allow sharing connections between threads
+    poolclass=StaticPool,  # The CLI keeps a single connection open
 )
 
+# Per-connection SQLite settings; WAL lets the CLI read while a vote is
+# being written, and synchronous=NORMAL avoids an fsync on every commit
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Apply SQLITE_PRAGMAS to every new database connection.
+
+    Args:
+        dbapi_connection: Raw sqlite3 connection
+        connection_record: Pool record for the connection (unused)
+    """
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
 
 def create_db_and_tables():
     """
@@ -4,7 +4,7 @@ HashVote data models using SQLModel.
 
 from typing import Optional
 from datetime import datetime
-from sqlmodel import SQLModel, Field, UniqueConstraint
+from sqlmodel import SQLModel, Field, Index, UniqueConstraint
 
 
 class Block(SQLModel, table=True):
@@ -23,6 +23,8 @@ class Block(SQLModel, table=True):
             "voter_hash",
             name="unique_vote",
         ),
+        # Covers per-poll choice and daily statistics
+        Index("ix_blocks_poll_choice_ts", "poll_id", "choice", "timestamp"),
     )
 
     id: Optional[int] = Field(default=None, primary_key=True)
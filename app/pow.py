@@ -5,11 +5,83 @@ This module provides functions for computing and verifying proof-of-work
 for the blockchain-based voting system.
 """
 
+import functools
 import hashlib
+import multiprocessing
+import os
+import signal
 import time
-from typing import Optional
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
 from datetime import datetime
 
+# Number of nonces tried between checks of the timeout and stop event
+CHECK_INTERVAL = 4096
+
+# Nonces wrap within 63 bits so they fit a signed SQLite INTEGER column
+NONCE_MASK = (1 << 63) - 1
+
+# Seconds between progress reports while waiting for parallel workers
+PROGRESS_INTERVAL = 0.1
+
+# Below this difficulty a search takes fewer nonces than one batch per
+# worker, so handing it to the worker pool costs more than it saves
+PARALLEL_MIN_DIFFICULTY = 12
+
+# Shared flag set in worker processes by _init_worker; non-zero once
+# any worker has found a valid nonce
+_stop_flag = None
+
+# Shared counter of nonces tried by all worker processes
+_hash_count = None
+
+# Worker pool kept alive between searches in the parent process, as
+# (workers, executor, stop_flag, hash_count); created by _get_pool
+_pool = None
+
+
+def encode_prefix(
+    poll_id: str,
+    voter_hash: str,
+    choice: str,
+    timestamp: datetime,
+    prev_hash: str,
+) -> bytes:
+    """
+    Encode the block fields that precede the nonce in the hashed data.
+
+    Args:
+        poll_id: Identifier for the poll
+        voter_hash: Hash identifying the voter
+        choice: Vote choice
+        timestamp: Block creation timestamp
+        prev_hash: Hash of the previous block
+
+    Returns:
+        UTF-8 encoded block data without the nonce
+    """
+    timestamp_str = timestamp.isoformat()
+    prefix = f"{poll_id}{voter_hash}{choice}{timestamp_str}{prev_hash}"
+    return prefix.encode("utf-8")
+
+
+@functools.lru_cache(maxsize=8)
+def _max_digest(difficulty_bits: int) -> bytes:
+    """
+    Get the largest digest that satisfies a difficulty.
+
+    Bytes compare lexicographically, so digest <= _max_digest(d) is the
+    same as hash < 2^(256 - d) for the digest as a big-endian integer.
+
+    Args:
+        difficulty_bits: Number of leading zero bits required
+
+    Returns:
+        32-byte big-endian threshold
+    """
+    return ((1 << (256 - difficulty_bits)) - 1).to_bytes(32, "big")
+
 
 def hash_block(
     poll_id: str,
@@ -18,6 +90,7 @@ def hash_block(
     timestamp: datetime,
     prev_hash: str,
     nonce: int,
+    prefix: Optional[bytes] = None,
 ) -> str:
     """
     Compute SHA-256 hash of a block.
@@ -29,20 +102,21 @@ def hash_block(
         timestamp: Block creation timestamp
         prev_hash: Hash of the previous block
         nonce: Proof-of-work nonce value
+        prefix: Result of encode_prefix for the same fields (optional)
 
     Returns:
         Hexadecimal SHA-256 hash string
     """
-    # Convert timestamp to ISO format string for consistent hashing
-    timestamp_str = timestamp.isoformat()
+    if prefix is None:
+        prefix = encode_prefix(
+            poll_id, voter_hash, choice, timestamp, prev_hash
+        )
 
-    # Concatenate all fields in a specific order
-    block_data = (
-        f"{poll_id}{voter_hash}{choice}{timestamp_str}{prev_hash}{nonce}"
-    )
+    # Block data is the encoded fields followed by the nonce digits
+    block_data = prefix + b"%d" % nonce
 
     # Compute SHA-256 hash
-    return hashlib.sha256(block_data.encode("utf-8")).hexdigest()
+    return hashlib.sha256(block_data).hexdigest()
 
 
 def compute_nonce(
@@ -53,6 +127,10 @@ def compute_nonce(
     prev_hash: str,
     difficulty_bits: int = 18,
     timeout: Optional[float] = None,
+    start_nonce: int = 0,
+    stride: int = 1,
+    progress: Optional[Callable[[int], None]] = None,
+    prefix: Optional[bytes] = None,
 ) -> Optional[int]:
     """
     Compute a nonce that satisfies the proof-of-work difficulty requirement.
@@ -70,36 +148,282 @@ def compute_nonce(
         prev_hash: Hash of the previous block
         difficulty_bits: Number of leading zero bits required (default: 18)
         timeout: Maximum computation time in seconds (optional)
+        start_nonce: First nonce to try (default: 0)
+        stride: Step between tried nonces (default: 1)
+        progress: Called with the number of nonces tried after each batch
+            (optional)
+        prefix: Result of encode_prefix for the same fields (optional)
 
     Returns:
-        Valid nonce value, or None if timeout exceeded
+        Valid nonce value, or None if timeout exceeded or another
+        worker found a nonce first
+    """
+    if prefix is None:
+        prefix = encode_prefix(
+            poll_id, voter_hash, choice, timestamp, prev_hash
+        )
+
+    return compute_nonce_prefixed(
+        prefix,
+        difficulty_bits=difficulty_bits,
+        timeout=timeout,
+        start_nonce=start_nonce,
+        stride=stride,
+        progress=progress,
+    )
+
+
+def compute_nonce_prefixed(
+    prefix: bytes,
+    difficulty_bits: int = 18,
+    timeout: Optional[float] = None,
+    start_nonce: int = 0,
+    stride: int = 1,
+    progress: Optional[Callable[[int], None]] = None,
+) -> Optional[int]:
+    """
+    Compute a nonce for block data already encoded by encode_prefix.
+
+    Args:
+        prefix: Encoded block fields that precede the nonce
+        difficulty_bits: Number of leading zero bits required (default: 18)
+        timeout: Maximum computation time in seconds (optional)
+        start_nonce: First nonce to try (default: 0)
+        stride: Step between tried nonces (default: 1)
+        progress: Called with the number of nonces tried after each batch
+            (optional)
+
+    Returns:
+        Valid nonce value, or None if timeout exceeded or another
+        worker found a nonce first
     """
     start_time = time.time()
-    nonce = 0
+    nonce = start_nonce
+
+    # Precompute the largest valid digest for the difficulty
+    max_digest = _max_digest(difficulty_bits)
 
-    # Calculate the target value based on difficulty
-    # For 18 bits, we need the first 18 bits to be zero
-    # This means the hash value must be less than 2^(256-18) = 2^238
-    target = 2 ** (256 - difficulty_bits)
+    # Hash the fixed block fields once; each nonce only extends a copy
+    # of this SHA-256 midstate with its own digits
+    midstate = hashlib.sha256(prefix)
+
+    copy_midstate = midstate.copy
 
     while True:
-        # Check timeout
+        # Check timeout and stop event once per batch of nonces
         if timeout and (time.time() - start_time) > timeout:
             return None
+        if _stop_flag is not None and _stop_flag.value:
+            return None
+
+        # Try a batch of CHECK_INTERVAL nonces in a tight loop
+        batch_end = nonce + stride * CHECK_INTERVAL
+        candidates = range(nonce, batch_end, stride)
+        if batch_end > NONCE_MASK:
+            candidates = (n & NONCE_MASK for n in candidates)
 
-        # Compute hash with current nonce
-        block_hash = hash_block(
-            poll_id, voter_hash, choice, timestamp, prev_hash, nonce
+        for candidate in candidates:
+            # Compute hash with current nonce
+            # b"%d" formats the nonce digits straight to bytes, skipping
+            # the intermediate str and its encode call
+            hasher = copy_midstate()
+            hasher.update(b"%d" % candidate)
+
+            digest = hasher.digest()
+
+            # Check if hash meets difficulty requirement
+            if digest <= max_digest:
+                if _stop_flag is not None:
+                    _stop_flag.value = 1
+                return candidate
+
+        if progress is not None:
+            progress(CHECK_INTERVAL)
+
+        nonce = batch_end & NONCE_MASK
+
+
+def _init_worker(stop_flag, hash_count) -> None:
+    """
+    Initialize a mining worker process.
+
+    Args:
+        stop_flag: Shared byte set once any worker has found a valid nonce
+        hash_count: Shared counter of nonces tried by all workers
+    """
+    global _stop_flag, _hash_count
+    # Ctrl+C is handled by the parent, which stops the workers through
+    # the shared flag; without this every worker prints a traceback
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _stop_flag = stop_flag
+    _hash_count = hash_count
+
+
+def _count_hashes(count: int) -> None:
+    """
+    Add nonces tried by this worker to the shared counter.
+
+    Args:
+        count: Number of nonces tried since the last report
+    """
+    with _hash_count.get_lock():
+        _hash_count.value += count
+
+
+def _get_pool(workers: int):
+    """
+    Get the worker pool, creating it on first use.
+
+    Starting worker processes costs more than a low-difficulty search,
+    so the pool and its shared values are reused for every vote.
+
+    Args:
+        workers: Number of worker processes
+
+    Returns:
+        Tuple of (executor, stop_flag, hash_count)
+    """
+    global _pool
+    if _pool is not None and _pool[0] != workers:
+        shutdown_pool()
+
+    if _pool is None:
+        # Lock-free flag: a plain shared byte is enough for a one-way
+        # signal
+        stop_flag = multiprocessing.Value("b", 0, lock=False)
+        hash_count = multiprocessing.Value("q", 0)
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(stop_flag, hash_count),
         )
+        _pool = (workers, executor, stop_flag, hash_count)
 
-        # Convert hex hash to integer for comparison
-        hash_int = int(block_hash, 16)
+    return _pool[1:]
 
-        # Check if hash meets difficulty requirement
-        if hash_int < target:
-            return nonce
 
-        nonce += 1
+def shutdown_pool() -> None:
+    """
+    Shut down the worker pool kept by compute_nonce_parallel, if any.
+
+    The next parallel search starts a new pool.
+    """
+    global _pool
+    if _pool is not None:
+        _pool[1].shutdown(cancel_futures=True)
+        _pool = None
+
+
+def compute_nonce_parallel(
+    poll_id: str,
+    voter_hash: str,
+    choice: str,
+    timestamp: datetime,
+    prev_hash: str,
+    difficulty_bits: int = 18,
+    timeout: Optional[float] = None,
+    workers: Optional[int] = None,
+    start_nonce: int = 0,
+    progress: Optional[Callable[[int], None]] = None,
+    prefix: Optional[bytes] = None,
+) -> Optional[int]:
+    """
+    Compute a nonce using several worker processes.
+
+    Worker i tries nonces start_nonce + i, start_nonce + i + workers, ...
+    so the workers never probe the same nonce. The first worker to find a valid
+    nonce sets a shared flag and the others stop at their next check.
+    Searches below PARALLEL_MIN_DIFFICULTY run in this process instead.
+
+    Args:
+        poll_id: Identifier for the poll
+        voter_hash: Hash identifying the voter
+        choice: Vote choice
+        timestamp: Block creation timestamp
+        prev_hash: Hash of the previous block
+        difficulty_bits: Number of leading zero bits required (default: 18)
+        timeout: Maximum computation time in seconds (optional)
+        workers: Number of worker processes (default: CPU count)
+        start_nonce: First nonce of the search (default: 0)
+        progress: Called in this process with the number of nonces tried
+            by all workers since the last call (optional)
+        prefix: Result of encode_prefix for the same fields (optional)
+
+    Returns:
+        Valid nonce value, or None if timeout exceeded
+    """
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or difficulty_bits < PARALLEL_MIN_DIFFICULTY:
+        return compute_nonce(
+            poll_id,
+            voter_hash,
+            choice,
+            timestamp,
+            prev_hash,
+            difficulty_bits=difficulty_bits,
+            timeout=timeout,
+            start_nonce=start_nonce,
+            progress=progress,
+            prefix=prefix,
+        )
+
+    # Workers only need the encoded prefix, not the individual fields
+    if prefix is None:
+        prefix = encode_prefix(
+            poll_id, voter_hash, choice, timestamp, prev_hash
+        )
+
+    executor, stop_flag, hash_count = _get_pool(workers)
+    stop_flag.value = 0
+    with hash_count.get_lock():
+        hash_count.value = 0
+
+    futures = []
+    try:
+        for i in range(workers):
+            futures.append(
+                executor.submit(
+                    compute_nonce_prefixed,
+                    prefix,
+                    difficulty_bits=difficulty_bits,
+                    timeout=timeout,
+                    start_nonce=(start_nonce + i) & NONCE_MASK,
+                    stride=workers,
+                    progress=_count_hashes if progress is not None else None,
+                )
+            )
+
+        reported = 0
+        pending = set(futures)
+        while pending:
+            done, pending = wait(
+                pending,
+                timeout=PROGRESS_INTERVAL,
+                return_when=FIRST_COMPLETED,
+            )
+
+            if progress is not None:
+                tried = hash_count.value
+                progress(tried - reported)
+                reported = tried
+
+            for future in done:
+                nonce = future.result()
+                if nonce is not None:
+                    return nonce
+    except BrokenProcessPool:
+        # A dead worker leaves the executor unusable; drop it so the
+        # next search starts a fresh pool
+        shutdown_pool()
+        raise
+    finally:
+        # Stop the remaining workers and let them finish before the
+        # shared values are reset for the next search
+        stop_flag.value = 1
+        wait(futures)
+
+    return None
 
 
 def verify_pow(
@@ -110,6 +434,7 @@ def verify_pow(
     prev_hash: str,
     nonce: int,
     difficulty_bits: int = 18,
+    prefix: Optional[bytes] = None,
 ) -> bool:
     """
     Verify that a nonce produces a valid proof-of-work.
@@ -122,28 +447,24 @@ def verify_pow(
         prev_hash: Hash of the previous block
         nonce: Nonce value to verify
         difficulty_bits: Required number of leading zero bits (default: 18)
+        prefix: Result of encode_prefix for the same fields (optional)
 
     Returns:
         True if the nonce produces a valid proof-of-work, False
         otherwise
     """
-    # Compute hash with the given nonce
-    block_hash = hash_block(
-        poll_id,
-        voter_hash,
-        choice,
-        timestamp,
-        prev_hash,
-        nonce,
-    )
+    if prefix is None:
+        prefix = encode_prefix(
+            poll_id, voter_hash, choice, timestamp, prev_hash
+        )
 
-    # Convert to integer and check against target
-    hash_int = int(block_hash, 16)
-    target = 2 ** (256 - difficulty_bits)
+    # Compare the raw digest against the target without a hex round trip
+    digest = hashlib.sha256(prefix + b"%d" % nonce).digest()
 
-    return hash_int < target
+    return digest <= _max_digest(difficulty_bits)
 
 
+@functools.lru_cache(maxsize=8)
 def get_difficulty_target(difficulty_bits: int = 18) -> str:
     """
     Get the difficulty target as a hexadecimal string.
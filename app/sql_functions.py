@@ -5,22 +5,26 @@ SQL直接操作機能
 
 import sqlite3
 import os
-import shutil
 from datetime import datetime
 from typing import List, Dict, Any, Tuple
 from pathlib import Path
 
 from .database import DATABASE_URL
 
+# 複数行INSERT 1文あたりの行数
+# 7列×142行で、SQLite 3.32未満のバインド変数上限999に収まる
+BULK_INSERT_ROWS = 999 // 7
+
 
 class SQLManager:
     """SQLiteデータベースの直接操作を管理するクラス"""
 
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, pragmas: Tuple[str, ...] = ()):
         """SQLManager初期化
 
         Args:
             db_path: データベースファイルパス（デフォルトは設定から取得）
+            pragmas: 接続を開くたびに実行するPRAGMA文
         """
         if db_path is None:
             # DATABASE_URLから実際のファイルパスを抽出
@@ -29,30 +33,51 @@ class SQLManager:
             self.db_path = db_path
 
         self.project_root = Path(__file__).parent.parent
+        self.pragmas = pragmas
+        self._conn = None
 
     def get_connection(self) -> sqlite3.Connection:
         """データベース接続を取得
 
+        初回に開いた接続を使い回し、sqlite3の文キャッシュを有効に活かす
+
         Returns:
             SQLite接続オブジェクト
         """
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # 辞書形式でアクセス可能
-        return conn
+        if self._conn is None:
+            # 書き込みトランザクションは開始時に予約ロックを取り、途中での
+            # ロック昇格によるSQLITE_BUSYを避ける（待機はtimeoutの既定5秒）
+            self._conn = sqlite3.connect(
+                self.db_path,
+                check_same_thread=False,
+                isolation_level="IMMEDIATE",
+            )
+            self._conn.row_factory = sqlite3.Row  # 辞書形式でアクセス可能
+            for pragma in self.pragmas:
+                self._conn.execute(pragma)
+        return self._conn
+
+    def close(self) -> None:
+        """保持しているデータベース接続を閉じる"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
 
     def execute_query(
         self,
         query: str,
         params: tuple = None,
+        as_dict: bool = True,
     ) -> List[Dict[str, Any]]:
         """SQLクエリを実行して結果を返す
 
         Args:
             query: 実行するSQL文
             params: クエリパラメータ
+            as_dict: Falseの場合は行ごとの辞書を作らずsqlite3.Rowのまま返す
 
         Returns:
-            クエリ結果のリスト（辞書形式）
+            クエリ結果のリスト（辞書形式、またはsqlite3.Row）
         """
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -67,11 +92,47 @@ class SQLManager:
                 "PRAGMA"
             ):
                 rows = cursor.fetchall()
+                if not as_dict:
+                    return rows
                 return [dict(row) for row in rows]
             else:
                 conn.commit()
                 return []
 
+    def execute_many(self, query: str, params_seq) -> None:
+        """同じSQL文を複数のパラメータで1トランザクション内に実行
+
+        Args:
+            query: 実行するSQL文
+            params_seq: パラメータのシーケンス
+        """
+        with self.get_connection() as conn:
+            conn.executemany(query, params_seq)
+            conn.commit()
+
+    def bulk_insert_blocks(self, rows: List[Tuple]) -> None:
+        """ブロックを複数行VALUESのINSERTでまとめて挿入
+
+        1行ごとに文を実行するexecutemanyより、文の実行回数が少なく済む
+
+        Args:
+            rows: (poll_id, voter_hash, choice, timestamp, prev_hash,
+                nonce, block_hash)のタプルのリスト
+        """
+        with self.get_connection() as conn:
+            for start in range(0, len(rows), BULK_INSERT_ROWS):
+                chunk = rows[start : start + BULK_INSERT_ROWS]
+                placeholders = ", ".join(
+                    ["(?, ?, ?, ?, ?, ?, ?)"] * len(chunk)
+                )
+                conn.execute(
+                    "INSERT INTO blocks (poll_id, voter_hash, choice, "
+                    "timestamp, prev_hash, nonce, block_hash) "
+                    f"VALUES {placeholders}",
+                    [value for row in chunk for value in row],
+                )
+            conn.commit()
+
     def execute_script(self, sql_script: str) -> None:
         """複数のSQL文を含むスクリプトを実行
 
@@ -104,7 +165,10 @@ class SQLManager:
 
     def init_database(self) -> None:
         """データベースを初期化（全テーブル削除後再作成）"""
+        # 削除と再作成を1トランザクションにまとめ、DDLごとのコミットを避ける
         init_sql = """
+        BEGIN;
+
         -- 既存テーブルを削除
         DROP TABLE IF EXISTS blocks;
 
@@ -125,15 +189,27 @@ class SQLManager:
         CREATE INDEX ix_blocks_poll_id ON blocks (poll_id);
         CREATE INDEX ix_blocks_block_hash ON blocks (block_hash);
         CREATE INDEX ix_blocks_timestamp ON blocks (timestamp);
+        CREATE INDEX ix_blocks_poll_choice_ts
+            ON blocks (poll_id, choice, timestamp);
+
+        COMMIT;
         """
 
         self.execute_script(init_sql)
 
-    def backup_database(self, backup_path: str = None) -> str:
+    def backup_database(
+        self,
+        backup_path: str = None,
+        pages: int = 1024,
+    ) -> str:
         """データベースをバックアップ
 
+        SQLiteのオンラインバックアップAPIでページ単位にコピーするため、
+        WALファイルに残っているコミット済みの変更もバックアップに含まれる
+
         Args:
             backup_path: バックアップファイルパス（未指定時は自動生成）
+            pages: 1回にコピーするページ数
 
         Returns:
             作成されたバックアップファイルのパス
@@ -142,7 +218,11 @@ class SQLManager:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_path = f"hashvote_backup_{timestamp}.db"
 
-        shutil.copy2(self.db_path, backup_path)
+        backup_conn = sqlite3.connect(backup_path)
+        try:
+            self.get_connection().backup(backup_conn, pages=pages)
+        finally:
+            backup_conn.close()
         return backup_path
 
     def restore_database(self, backup_path: str) -> None:
@@ -156,7 +236,13 @@ class SQLManager:
                 f"バックアップファイルが見つかりません: {backup_path}"
             )
 
-        shutil.copy2(backup_path, self.db_path)
+        # ファイルを上書きせず開いている接続へページをコピーし、
+        # WALファイルと食い違った状態が残らないようにする
+        backup_conn = sqlite3.connect(backup_path)
+        try:
+            backup_conn.backup(self.get_connection())
+        finally:
+            backup_conn.close()
 
     def get_table_info(self) -> Dict[str, List[Dict[str, Any]]]:
         """テーブル情報を取得
@@ -185,10 +271,12 @@ class SQLManager:
         stats = {}
 
         # ファイルサイズ
-        stats["file_size_bytes"] = (
-            os.path.getsize(self.db_path)
-            if os.path.exists(self.db_path)
-            else 0
+        # WALモードではチェックポイントまで最近のコミットが-walファイルに
+        # 残るため、その分も合算する
+        stats["file_size_bytes"] = sum(
+            os.path.getsize(path)
+            for path in (self.db_path, f"{self.db_path}-wal")
+            if os.path.exists(path)
         )
         stats["file_size_mb"] = round(
             stats["file_size_bytes"] / (1024 * 1024),
@@ -196,18 +284,21 @@ class SQLManager:
         )
 
         # テーブル統計
+        # 件数だけが必要なので列情報は取得せず、1つの接続でCOUNT(*)を実行する
         table_stats = {}
-        table_info = self.get_table_info()
+        tables_query = "SELECT name FROM sqlite_master WHERE type='table'"
 
-        for table_name in table_info.keys():
-            count_query = f"SELECT COUNT(*) as count FROM {table_name}"
-            result = self.execute_query(count_query)
-            table_stats[table_name] = result[0]["count"] if result else 0
+        with self.get_connection() as conn:
+            table_names = [row[0] for row in conn.execute(tables_query)]
+            for table_name in table_names:
+                count_query = f"SELECT COUNT(*) FROM {table_name}"
+                (count,) = conn.execute(count_query).fetchone()
+                table_stats[table_name] = count
 
         stats["table_counts"] = table_stats
 
         # ブロック関連統計（blocksテーブルが存在する場合）
-        if "blocks" in table_info:
+        if "blocks" in table_stats:
             # 投票数の多い順にpoll_idを取得
             poll_stats_query = """
             SELECT poll_id, COUNT(*) as vote_count
@@ -237,35 +328,38 @@ class SQLManager:
             (整合性OK, エラーメッセージリスト)のタプル
         """
         errors = []
-
-        # ブロックを順番に取得
-        blocks_query = "SELECT * FROM blocks ORDER BY id"
-        blocks = self.execute_query(blocks_query)
-
-        if not blocks:
-            return True, []
+        genesis_hash = "0" * 64
 
         # 各ブロックの検証
         prev_hash_map = {}  # poll_id -> 最新ブロックハッシュ
 
-        for block in blocks:
-            poll_id = block["poll_id"]
-            current_hash = block["block_hash"]
-            prev_hash = block["prev_hash"]
-
-            # 最初のブロック（前ハッシュが全ゼロ）でない場合
-            if prev_hash != "0" * 64:
-                if poll_id not in prev_hash_map:
-                    errors.append(
-                        f"ブロックID {block['id']}: 前ブロックが存在しません"
-                    )
-                elif prev_hash_map[poll_id] != prev_hash:
-                    errors.append(
-                        f"ブロックID {block['id']}: 前ブロックハッシュが不正です"
-                    )
-
-            # 現在のブロックハッシュを記録
-            prev_hash_map[poll_id] = current_hash
+        # 連結の検証に必要な列だけを順番に取得し、全件を辞書化せず
+        # カーソルから1行ずつ処理する
+        blocks_query = (
+            "SELECT id, poll_id, prev_hash, block_hash FROM blocks ORDER BY id"
+        )
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            for block_id, poll_id, prev_hash, current_hash in cursor.execute(
+                blocks_query
+            ):
+                # 最初のブロック（前ハッシュが全ゼロ）でない場合
+                if prev_hash != genesis_hash:
+                    if poll_id not in prev_hash_map:
+                        errors.append(
+                            f"ブロックID {block_id}: 前ブロックが存在しません"
+                        )
+                    elif prev_hash_map[poll_id] != prev_hash:
+                        errors.append(
+                            f"ブロックID {block_id}: 前ブロックハッシュが不正です"
+                        )
+
+                # 現在のブロックハッシュを記録
+                prev_hash_map[poll_id] = current_hash
+
+        if not prev_hash_map:
+            return True, []
 
         # 重複投票の確認
         duplicate_query = """
@@ -274,7 +368,7 @@ class SQLManager:
         GROUP BY poll_id, voter_hash
         HAVING COUNT(*) > 1
         """
-        duplicates = self.execute_query(duplicate_query)
+        duplicates = self.execute_query(duplicate_query, as_dict=False)
 
         if duplicates:
             for dup in duplicates:
@@ -296,27 +390,28 @@ class SQLManager:
         """
         stats = {}
 
-        # ベースクエリ
-        where_clause = f"WHERE poll_id = '{poll_id}'" if poll_id else ""
-
-        # 総投票数
-        total_votes_query = (
-            f"SELECT COUNT(*) as total FROM blocks {where_clause}"
-        )
-        total_result = self.execute_query(total_votes_query)
-        stats["total_votes"] = total_result[0]["total"] if total_result else 0
+        # ベースクエリ（poll_idは文字列埋め込みではなくパラメータで渡す）
+        where_clause = "WHERE poll_id = ?" if poll_id else ""
+        params = (poll_id,) if poll_id else None
 
         # 選択肢別投票数
+        # 割合の分母はウィンドウ関数で集計結果から求め、blocksの再走査を避ける
         choice_stats_query = f"""
         SELECT choice, COUNT(*) as count,
-               ROUND(COUNT(*) * 100.0 /
-                     (SELECT COUNT(*) FROM blocks {where_clause}), 2)
+               ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER (), 2)
                as percentage
         FROM blocks {where_clause}
         GROUP BY choice
         ORDER BY count DESC
         """
-        stats["choice_distribution"] = self.execute_query(choice_stats_query)
+        stats["choice_distribution"] = self.execute_query(
+            choice_stats_query, params
+        )
+
+        # 総投票数（選択肢別の件数の合計）
+        stats["total_votes"] = sum(
+            row["count"] for row in stats["choice_distribution"]
+        )
 
         # 時系列統計
         timeline_query = f"""
@@ -325,7 +420,7 @@ class SQLManager:
         GROUP BY DATE(timestamp)
         ORDER BY vote_date
         """
-        stats["daily_timeline"] = self.execute_query(timeline_query)
+        stats["daily_timeline"] = self.execute_query(timeline_query, params)
 
         # poll_id別統計（全体統計の場合のみ）
         if poll_id is None:
@@ -52,6 +52,9 @@ CREATE INDEX ix_blocks_voter_hash ON blocks (voter_hash);
 -- 複合インデックス：投票ID + 時系列順での検索最適化
 CREATE INDEX ix_blocks_poll_timestamp ON blocks (poll_id, timestamp);
 
+-- 複合インデックス：投票ID別の選択肢・日別集計をテーブルを読まずに行う
+CREATE INDEX ix_blocks_poll_choice_ts ON blocks (poll_id, choice, timestamp);
+
 -- 初期化完了メッセージ用のビュー作成
 -- （このビューは実際のデータではなく、初期化確認用）
 CREATE VIEW database_info AS
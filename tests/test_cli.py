@@ -2,38 +2,126 @@
 Unit tests for CLI functionality.
 """
 
+import hashlib
+import io
 import pytest
+from concurrent.futures.process import BrokenProcessPool
 from unittest.mock import patch
 from datetime import datetime, timezone
-from sqlmodel import Session, SQLModel, create_engine
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel, create_engine, insert, select
 from sqlmodel.pool import StaticPool
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
 
 from app.cli import HashVoteCLI
 from app.models import Block
 
+# Fixed timestamp for seeded blocks so test data is deterministic
+TIMESTAMP = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+# Stored voter hash for the "voter1" identifier used in duplicate tests
+VOTER1_HASH = hashlib.sha256(b"voter1").hexdigest()
+
+
+def _seed_blocks(session, rows, poll_id="test_poll"):
+    """Insert (voter, choice) rows as blocks with a single commit."""
+    # Core executemany skips per-object unit-of-work bookkeeping
+    session.execute(
+        insert(Block),
+        [
+            {
+                "poll_id": poll_id,
+                "voter_hash": f"hash_{voter}",
+                "choice": choice,
+                "timestamp": TIMESTAMP,
+                "prev_hash": "0" * 64,
+                "nonce": 42 + i,
+                "block_hash": f"hash_{i}",
+            }
+            for i, (voter, choice) in enumerate(rows)
+        ],
+    )
+    session.commit()
 
-# Create test database
-@pytest.fixture(name="session")
-def session_fixture():
-    """Create a test database session."""
+
+# Create test database once; each test runs in a transaction that is
+# rolled back afterwards
+@pytest.fixture(name="engine", scope="session")
+def engine_fixture():
+    """Create the in-memory test database engine."""
     engine = create_engine(
         "sqlite:///:memory:",
         connect_args={"check_same_thread": False},
         poolclass=StaticPool,
     )
+
+    # pysqlite emits BEGIN lazily and mishandles SAVEPOINT; let
+    # SQLAlchemy issue BEGIN itself so per-test rollback works
+    @event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def do_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
     SQLModel.metadata.create_all(engine)
-    with Session(engine) as session:
-        yield session
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture(name="session")
+def session_fixture(engine):
+    """Create a test database session isolated in a transaction."""
+    connection = engine.connect()
+    transaction = connection.begin()
+    # Commits inside the test only release a SAVEPOINT; seeded objects
+    # stay loaded so reading them back does not re-SELECT
+    session = Session(
+        bind=connection,
+        join_transaction_mode="create_savepoint",
+        expire_on_commit=False,
+    )
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
 
 
 @pytest.fixture(name="cli_app")
 def cli_app_fixture(session: Session):
     """Create a CLI app with test database."""
-    app = HashVoteCLI()
-    app.session = session
+    # Skip creating the on-disk database; the app only needs a session
+    with patch("app.cli.create_db_and_tables"), patch(
+        "app.cli.get_session_direct", return_value=session
+    ):
+        app = HashVoteCLI()
     return app
 
 
+@pytest.fixture(name="mock_ask")
+def mock_ask_fixture():
+    """Patch Rich prompt input for handler tests."""
+    with patch("rich.prompt.Prompt.ask") as mock:
+        yield mock
+
+
+@pytest.fixture(name="mock_print")
+def mock_print_fixture():
+    """Patch Rich console output for handler tests."""
+    with patch("rich.console.Console.print") as mock:
+        yield mock
+
+
+@pytest.fixture(name="mock_rule")
+def mock_rule_fixture():
+    """Patch Rich console rules for handler tests."""
+    with patch("rich.console.Console.rule") as mock:
+        yield mock
+
+
 class TestHashVoteCLI:
     """Test cases for HashVoteCLI class."""
 
@@ -48,55 +136,6 @@ class TestHashVoteCLI:
             # Rich console should be initialized
             assert hasattr(app, "console")
 
-    def test_get_latest_block_hash_empty(self, cli_app: HashVoteCLI):
-        """Test getting latest block hash when no blocks exist."""
-        result = cli_app.get_latest_block_hash("test_poll")
-        assert result == "0" * 64
-
-    def test_get_latest_block_hash_with_blocks(self, cli_app: HashVoteCLI):
-        """Test getting latest block hash with existing blocks."""
-        # Add a test block
-        timestamp = datetime.now(timezone.utc)
-        block = Block(
-            poll_id="test_poll",
-            voter_hash="test_voter",
-            choice="option_a",
-            timestamp=timestamp,
-            prev_hash="0" * 64,
-            nonce=42,
-            block_hash="abcdef123456",
-        )
-        cli_app.session.add(block)
-        cli_app.session.commit()
-
-        result = cli_app.get_latest_block_hash("test_poll")
-        assert result == "abcdef123456"
-
-    def test_check_duplicate_vote_no_duplicate(self, cli_app: HashVoteCLI):
-        """Test duplicate vote check when no duplicate exists."""
-        result = cli_app.check_duplicate_vote("test_poll", "test_voter")
-        assert result is False
-
-    def test_check_duplicate_vote_with_duplicate(self, cli_app: HashVoteCLI):
-        """Test duplicate vote check when duplicate exists."""
-        # Add a test block
-        timestamp = datetime.now(timezone.utc)
-        block = Block(
-            poll_id="test_poll",
-            voter_hash="test_voter",
-            choice="option_a",
-            timestamp=timestamp,
-            prev_hash="0" * 64,
-            nonce=42,
-            block_hash="abcdef123456",
-        )
-        cli_app.session.add(block)
-        cli_app.session.commit()
-
-        result = cli_app.check_duplicate_vote("test_poll", "test_voter")
-        assert result is True
-
-    @patch("rich.prompt.Prompt.ask")
     def test_get_user_input(self, mock_ask, cli_app: HashVoteCLI):
         """Test user input handling with Rich Prompt."""
         mock_ask.return_value = "test_input"
@@ -110,7 +149,6 @@ class TestHashVoteCLI:
         cli_app.clear_screen()
         mock_clear.assert_called_once()
 
-    @patch("rich.console.Console.print")
     def test_display_header(self, mock_print, cli_app: HashVoteCLI):
         """Test header display with Rich formatting."""
         cli_app.display_header()
@@ -121,7 +159,6 @@ class TestHashVoteCLI:
         call_args = mock_print.call_args_list
         assert len(call_args) > 0
 
-    @patch("rich.console.Console.print")
     def test_display_menu(self, mock_print, cli_app: HashVoteCLI):
         """Test menu display with Rich table."""
         cli_app.display_menu()
@@ -135,52 +172,79 @@ class TestHashVoteCLI:
 class TestCLIVoteHandling:
     """Test cases for voting functionality."""
 
-    @patch("rich.prompt.Prompt.ask")
-    @patch("rich.console.Console.print")
-    @patch("rich.console.Console.rule")
-    def test_handle_vote_missing_poll_id(
-        self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
-    ):
-        """Test vote handling with missing poll ID."""
-        mock_ask.side_effect = ["", "option_a", "voter1"]  # Empty poll_id
+    def test_get_vote_context(self, cli_app: HashVoteCLI):
+        """Test the fused duplicate check and latest hash lookup."""
+        assert cli_app.get_vote_context("test_poll", "voter1") == (
+            False,
+            "0" * 64,
+        )
 
-        cli_app.handle_vote()
+        block = Block(
+            poll_id="test_poll",
+            voter_hash="voter1",
+            choice="option_a",
+            timestamp=TIMESTAMP,
+            prev_hash="0" * 64,
+            nonce=42,
+            block_hash="abcdef123456",
+        )
+        cli_app.session.add(block)
+        cli_app.session.commit()
 
-        # Check that error message was printed
-        error_calls = [
-            call
-            for call in mock_print.call_args_list
-            if any("エラー: 投票IDが必要です" in str(arg) for arg in call[0])
-        ]
-        assert len(error_calls) > 0
+        assert cli_app.get_vote_context("test_poll", "voter1") == (
+            True,
+            "abcdef123456",
+        )
+        assert cli_app.get_vote_context("test_poll", "voter2") == (
+            False,
+            "abcdef123456",
+        )
 
-    @patch("rich.prompt.Prompt.ask")
-    @patch("rich.console.Console.print")
-    @patch("rich.console.Console.rule")
-    def test_handle_vote_missing_choice(
-        self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
-    ):
-        """Test vote handling with missing choice."""
-        mock_ask.side_effect = ["test_poll", "", "voter1"]  # Empty choice
+    def test_get_vote_context_sees_external_block(self, cli_app: HashVoteCLI):
+        """Test that a block written after a lookup is chained onto."""
+        assert cli_app.get_vote_context("test_poll", "voter2") == (
+            False,
+            "0" * 64,
+        )
 
-        cli_app.handle_vote()
+        # A block saved outside handle_vote, e.g. by a restore
+        block = Block(
+            poll_id="test_poll",
+            voter_hash="voter1",
+            choice="option_a",
+            timestamp=TIMESTAMP,
+            prev_hash="0" * 64,
+            nonce=42,
+            block_hash="abcdef123456",
+        )
+        cli_app.session.add(block)
+        cli_app.session.commit()
 
-        # Check that error message was printed
-        error_calls = [
-            call
-            for call in mock_print.call_args_list
-            if any("エラー: 選択肢が必要です" in str(arg) for arg in call[0])
-        ]
-        assert len(error_calls) > 0
+        assert cli_app.get_vote_context("test_poll", "voter2") == (
+            False,
+            "abcdef123456",
+        )
 
-    @patch("rich.prompt.Prompt.ask")
-    @patch("rich.console.Console.print")
-    @patch("rich.console.Console.rule")
-    def test_handle_vote_missing_voter_id(
-        self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
+    @pytest.mark.parametrize(
+        "inputs,error",
+        [
+            (["", "option_a", "voter1"], "エラー: 投票IDが必要です"),
+            (["test_poll", "", "voter1"], "エラー: 選択肢が必要です"),
+            (["test_poll", "option_a", ""], "エラー: 投票者IDが必要です"),
+        ],
+        ids=["missing_poll_id", "missing_choice", "missing_voter_id"],
+    )
+    def test_handle_vote_missing_input(
+        self,
+        mock_rule,
+        mock_print,
+        mock_ask,
+        cli_app: HashVoteCLI,
+        inputs,
+        error,
     ):
-        """Test vote handling with missing voter ID."""
-        mock_ask.side_effect = ["test_poll", "option_a", ""]  # Empty voter_id
+        """Test vote handling with a missing required input."""
+        mock_ask.side_effect = inputs
 
         cli_app.handle_vote()
 
@@ -188,28 +252,20 @@ class TestCLIVoteHandling:
         error_calls = [
             call
             for call in mock_print.call_args_list
-            if any("エラー: 投票者IDが必要です" in str(arg) for arg in call[0])
+            if any(error in str(arg) for arg in call[0])
         ]
         assert len(error_calls) > 0
 
-    @patch("rich.prompt.Prompt.ask")
-    @patch("rich.console.Console.print")
-    @patch("rich.console.Console.rule")
     def test_handle_vote_duplicate(
         self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
     ):
         """Test vote handling with duplicate voter."""
         # Add existing vote
-        timestamp = datetime.now(timezone.utc)
-        import hashlib
-
-        voter_hash = hashlib.sha256("voter1".encode("utf-8")).hexdigest()
-
         block = Block(
             poll_id="test_poll",
-            voter_hash=voter_hash,
+            voter_hash=VOTER1_HASH,
             choice="option_a",
-            timestamp=timestamp,
+            timestamp=TIMESTAMP,
             prev_hash="0" * 64,
             nonce=42,
             block_hash="abcdef123456",
@@ -231,13 +287,91 @@ class TestCLIVoteHandling:
         ]
         assert len(error_calls) > 0
 
+    def test_handle_vote_duplicate_on_insert(
+        self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
+    ):
+        """Test that the unique constraint rejects a missed duplicate."""
+        mock_ask.side_effect = ["test_poll", "option_a", "voter1"]
+        cli_app.handle_vote()
+
+        # Simulate a duplicate that the pre-check did not see
+        mock_ask.side_effect = ["test_poll", "option_b", "voter1"]
+        _, prev_hash = cli_app.get_vote_context("test_poll", "voter1")
+        with patch.object(
+            cli_app, "get_vote_context", return_value=(False, prev_hash)
+        ):
+            cli_app.handle_vote()
+
+        error_calls = [
+            call
+            for call in mock_print.call_args_list
+            if any(
+                "この投票者は既に投票済みです" in str(arg) for arg in call[0]
+            )
+        ]
+        assert len(error_calls) > 0
+        assert len(cli_app.session.exec(select(Block)).all()) == 1
+
+    def test_handle_vote_other_integrity_error(
+        self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
+    ):
+        """Test that a non-vote constraint failure is not 'already voted'."""
+        _seed_blocks(cli_app.session, [("voter0", "option_a")])
+
+        # A second block with the same block_hash breaks its UNIQUE index
+        mock_ask.side_effect = ["test_poll", "option_b", "voter1"]
+        with patch("app.cli.hash_block", return_value="hash_0"):
+            cli_app.handle_vote()
+
+        messages = [
+            str(arg) for call in mock_print.call_args_list for arg in call[0]
+        ]
+        assert not any("既に投票済みです" in m for m in messages)
+        assert any("投票の保存に失敗しました" in m for m in messages)
+        assert len(cli_app.session.exec(select(Block)).all()) == 1
+
+    def test_handle_vote_success(
+        self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
+    ):
+        """Test that a successful vote is stored as a new block."""
+        # test_ polls use the low difficulty so mining is fast
+        mock_ask.side_effect = ["test_poll", "option_a", "voter1"]
+
+        cli_app.handle_vote()
+
+        block = cli_app.session.exec(select(Block)).one()
+        assert block.poll_id == "test_poll"
+        assert block.choice == "option_a"
+        assert block.prev_hash == "0" * 64
+        assert cli_app.get_vote_context("test_poll", "voter2") == (
+            False,
+            block.block_hash,
+        )
+
+    def test_handle_vote_mining_error(
+        self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
+    ):
+        """Test that a failed nonce search is reported, not raised."""
+        mock_ask.side_effect = ["test_poll", "option_a", "voter1"]
+
+        with patch(
+            "app.cli.compute_nonce_parallel",
+            side_effect=BrokenProcessPool("worker died"),
+        ):
+            cli_app.handle_vote()
+
+        error_panels = [
+            call[0][0]
+            for call in mock_print.call_args_list
+            if call[0] and isinstance(call[0][0], Panel)
+        ]
+        assert "worker died" in error_panels[-1].renderable
+        assert cli_app.session.exec(select(Block)).all() == []
+
 
 class TestCLIPollResults:
     """Test cases for poll result functionality."""
 
-    @patch("rich.prompt.Prompt.ask")
-    @patch("rich.console.Console.print")
-    @patch("rich.console.Console.rule")
     def test_handle_poll_result_empty(
         self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
     ):
@@ -254,34 +388,18 @@ class TestCLIPollResults:
         ]
         assert len(warning_calls) > 0
 
-    @patch("rich.prompt.Prompt.ask")
-    @patch("rich.console.Console.print")
-    @patch("rich.console.Console.rule")
     def test_handle_poll_result_with_votes(
         self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
     ):
         """Test poll result handling with votes."""
         # Add test votes
-        timestamp = datetime.now(timezone.utc)
         votes = [
             ("voter1", "option_a"),
             ("voter2", "option_a"),
             ("voter3", "option_b"),
         ]
 
-        for i, (voter, choice) in enumerate(votes):
-            block = Block(
-                poll_id="test_poll",
-                voter_hash=f"hash_{voter}",
-                choice=choice,
-                timestamp=timestamp,
-                prev_hash="0" * 64,
-                nonce=42 + i,
-                block_hash=f"hash_{i}",
-            )
-            cli_app.session.add(block)
-
-        cli_app.session.commit()
+        _seed_blocks(cli_app.session, votes)
 
         mock_ask.return_value = "test_poll"
 
@@ -291,13 +409,19 @@ class TestCLIPollResults:
         # At least summary panel and results table
         assert mock_print.call_count >= 2
 
+        # Summary panel should report the aggregated totals
+        summary = next(
+            call[0][0].renderable
+            for call in mock_print.call_args_list
+            if call[0] and isinstance(call[0][0], Panel)
+        )
+        assert "総投票数: [bold]3[/bold]票" in summary
+        assert "最多得票: [bold]option_a[/bold] (2票)" in summary
+
 
 class TestCLIAuditLog:
     """Test cases for audit log functionality."""
 
-    @patch("rich.prompt.Prompt.ask")
-    @patch("rich.console.Console.print")
-    @patch("rich.console.Console.rule")
     def test_handle_audit_log_empty(
         self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
     ):
@@ -314,33 +438,17 @@ class TestCLIAuditLog:
         ]
         assert len(warning_calls) > 0
 
-    @patch("rich.prompt.Prompt.ask")
-    @patch("rich.console.Console.print")
-    @patch("rich.console.Console.rule")
     def test_handle_audit_log_with_blocks(
         self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
     ):
         """Test audit log handling with blocks."""
         # Add test blocks
-        timestamp = datetime.now(timezone.utc)
         blocks_data = [
             ("voter1", "option_a"),
             ("voter2", "option_b"),
         ]
 
-        for i, (voter, choice) in enumerate(blocks_data):
-            block = Block(
-                poll_id="test_poll",
-                voter_hash=f"hash_{voter}",
-                choice=choice,
-                timestamp=timestamp,
-                prev_hash="0" * 64,
-                nonce=42 + i,
-                block_hash=f"hash_{i}",
-            )
-            cli_app.session.add(block)
-
-        cli_app.session.commit()
+        _seed_blocks(cli_app.session, blocks_data)
 
         mock_ask.return_value = "test_poll"
 
@@ -350,12 +458,72 @@ class TestCLIAuditLog:
         # (header, table, integrity panels)
         assert mock_print.call_count >= 3
 
+        # Every streamed block should become a table row
+        blocks_table = next(
+            call[0][0]
+            for call in mock_print.call_args_list
+            if call[0] and isinstance(call[0][0], Table)
+        )
+        assert blocks_table.row_count == 2
+
+    def test_handle_audit_log_paginated(
+        self, mock_rule, mock_print, mock_ask, cli_app: HashVoteCLI
+    ):
+        """Test that the audit log stops after a page when declined."""
+        _seed_blocks(
+            cli_app.session,
+            [(f"voter{i}", "option_a") for i in range(3)],
+        )
+
+        mock_ask.side_effect = ["test_poll", "y", "n"]
+
+        with patch("app.cli.AUDIT_PAGE_SIZE", 1):
+            cli_app.handle_audit_log()
+
+        tables = [
+            call[0][0]
+            for call in mock_print.call_args_list
+            if call[0] and isinstance(call[0][0], Table)
+        ]
+        assert [table.row_count for table in tables] == [1, 1]
+
+    def test_handle_audit_log_fits_80_columns(
+        self, mock_ask, cli_app: HashVoteCLI
+    ):
+        """Test that ID and a full 19-digit nonce fit in 80 columns."""
+        cli_app.session.execute(
+            insert(Block),
+            [
+                {
+                    "poll_id": "test_poll",
+                    "voter_hash": VOTER1_HASH,
+                    "choice": "option_a",
+                    "timestamp": TIMESTAMP,
+                    "prev_hash": "0" * 64,
+                    "nonce": 9223372036854775807,
+                    "block_hash": "0" * 58 + "abcdef",
+                }
+            ],
+        )
+        cli_app.session.commit()
+        block_id = cli_app.session.exec(select(Block.id)).one()
+
+        cli_app.console = Console(width=80, record=True, file=io.StringIO())
+        mock_ask.return_value = "test_poll"
+
+        cli_app.handle_audit_log()
+
+        output = cli_app.console.export_text()
+        assert "9223372036854775807" in output
+        header = next(line for line in output.splitlines() if "Nonce" in line)
+        assert "│ ID" in header
+        assert f"│ {block_id} " in output
+        assert "…abcdef" in output
+
 
 class TestCLIHealthCheck:
     """Test cases for health check functionality."""
 
-    @patch("rich.console.Console.print")
-    @patch("rich.console.Console.rule")
     def test_handle_health_check_success(
         self, mock_rule, mock_print, cli_app: HashVoteCLI
     ):
@@ -371,20 +539,15 @@ class TestCLIHealthCheck:
 class TestCLIMainLoop:
     """Test cases for main application loop."""
 
-    @patch("rich.prompt.Prompt.ask")
-    @patch("rich.console.Console.print")
-    @patch("app.cli.HashVoteCLI.clear_screen")
-    @patch("app.cli.HashVoteCLI.display_header")
-    @patch("app.cli.HashVoteCLI.display_menu")
-    def test_run_exit_choice(
-        self,
-        mock_menu,
-        mock_header,
-        mock_clear,
-        mock_print,
-        mock_ask,
-        cli_app: HashVoteCLI,
-    ):
+    @pytest.fixture(autouse=True)
+    def silence_screen(self):
+        """Skip screen clearing and header/menu rendering in the loop."""
+        with patch.object(HashVoteCLI, "clear_screen"), patch.object(
+            HashVoteCLI, "display_header"
+        ), patch.object(HashVoteCLI, "display_menu"):
+            yield
+
+    def test_run_exit_choice(self, mock_print, mock_ask, cli_app: HashVoteCLI):
         """Test running CLI with exit choice."""
         mock_ask.return_value = "5"  # Exit choice
 
@@ -395,21 +558,9 @@ class TestCLIMainLoop:
         # Verify that we tried to get input for menu choice
         mock_ask.assert_called()
 
-    @patch("rich.prompt.Prompt.ask")
-    @patch("rich.console.Console.print")
     @patch("builtins.input")  # For the continue prompt
-    @patch("app.cli.HashVoteCLI.clear_screen")
-    @patch("app.cli.HashVoteCLI.display_header")
-    @patch("app.cli.HashVoteCLI.display_menu")
     def test_run_invalid_choice(
-        self,
-        mock_menu,
-        mock_header,
-        mock_clear,
-        mock_input,
-        mock_print,
-        mock_ask,
-        cli_app: HashVoteCLI,
+        self, mock_input, mock_print, mock_ask, cli_app: HashVoteCLI
     ):
         """Test running CLI with invalid choice."""
         mock_ask.side_effect = ["9", "5"]  # Invalid choice then exit
@@ -4,12 +4,40 @@ app/sql_functions.pyの機能をテストする
 """
 
 import pytest
+import sqlite3
 import tempfile
+import threading
 import os
+import tracemalloc
+from pathlib import Path
 from datetime import datetime, timezone
-from unittest.mock import patch
 
-from app.sql_functions import SQLManager
+from app.sql_functions import BULK_INSERT_ROWS, SQLManager
+
+# テストデータ共通の固定タイムスタンプ（実行ごとに値が変わらないようにする）
+NOW = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+INSERT_BLOCK_SQL = """INSERT INTO blocks
+    (poll_id, voter_hash, choice, timestamp, prev_hash, nonce, block_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+# 本番と同じWALモードにしつつ、一時DBではコミットごとのfsyncを減らす
+WAL_TEST_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+)
+
+# 単体テストの一時DBは耐久性が不要なため、ジャーナルとfsyncを省き、
+# ロックも接続を閉じるまで保持する
+FAST_TEST_PRAGMAS = (
+    "PRAGMA journal_mode=OFF",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA locking_mode=EXCLUSIVE",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+)
 
 
 class TestSQLManager:
@@ -26,7 +54,19 @@ class TestSQLManager:
     @pytest.fixture
     def sql_manager(self, temp_db):
         """テスト用のSQLManagerインスタンスを作成"""
-        return SQLManager(temp_db)
+        manager = SQLManager(temp_db, pragmas=FAST_TEST_PRAGMAS)
+        yield manager
+        manager.close()
+
+    @pytest.fixture
+    def wal_sql_manager(self, temp_db):
+        """本番と同じWALモードのSQLManagerインスタンスを作成
+
+        バックアップ・復元や複数接続からの書き込みを検証するテストで使う
+        """
+        manager = SQLManager(temp_db, pragmas=WAL_TEST_PRAGMAS)
+        yield manager
+        manager.close()
 
     def test_init_database(self, sql_manager):
         """データベース初期化のテスト"""
@@ -62,7 +102,7 @@ class TestSQLManager:
                 "test_poll",
                 "voter123",
                 "yes",
-                datetime.now(timezone.utc),
+                NOW,
                 "0" * 64,
                 12345,
                 "block123",
@@ -89,7 +129,7 @@ class TestSQLManager:
                 "test_poll",
                 "voter123",
                 "yes",
-                datetime.now(timezone.utc),
+                NOW,
                 "0" * 64,
                 12345,
                 "block123",
@@ -105,6 +145,109 @@ class TestSQLManager:
         )
         assert count_result[0]["count"] == 1
 
+    def test_execute_query_rows(self, sql_manager):
+        """as_dict=Falseでsqlite3.Rowのまま返すテスト"""
+        sql_manager.init_database()
+        sql_manager.execute_many(
+            INSERT_BLOCK_SQL,
+            [("test_poll", "voter123", "yes", NOW, "0" * 64, 1, "block1")],
+        )
+
+        result = sql_manager.execute_query(
+            "SELECT poll_id, choice FROM blocks", as_dict=False
+        )
+        assert isinstance(result[0], sqlite3.Row)
+        assert result[0]["poll_id"] == "test_poll"
+        assert tuple(result[0]) == ("test_poll", "yes")
+
+    def test_execute_many(self, sql_manager):
+        """複数行の一括INSERTのテスト"""
+        sql_manager.init_database()
+
+        sql_manager.execute_many(
+            INSERT_BLOCK_SQL,
+            [
+                ("poll1", "voter1", "yes", NOW, "0" * 64, 123, "hash1"),
+                ("poll1", "voter2", "no", NOW, "hash1", 456, "hash2"),
+            ],
+        )
+
+        result = sql_manager.execute_query(
+            "SELECT COUNT(*) as count FROM blocks"
+        )
+        assert result[0]["count"] == 2
+
+    def test_pragmas_applied(self, sql_manager):
+        """接続時にPRAGMAが適用されることのテスト"""
+        result = sql_manager.execute_query("PRAGMA synchronous")
+        assert result[0]["synchronous"] == 0  # OFF
+
+    def test_bulk_insert_blocks(self, sql_manager):
+        """複数行INSERTが文の行数上限をまたいでも全行を挿入するテスト"""
+        sql_manager.init_database()
+
+        rows = [
+            ("poll1", f"voter{i}", "yes", NOW, "0" * 64, i, f"hash{i}")
+            for i in range(BULK_INSERT_ROWS * 2 + 1)
+        ]
+        sql_manager.bulk_insert_blocks(rows)
+
+        result = sql_manager.execute_query(
+            "SELECT COUNT(*) as count FROM blocks"
+        )
+        assert result[0]["count"] == len(rows)
+
+    def test_execute_many_concurrent_writers(self, wal_sql_manager, temp_db):
+        """別接続からの同時書き込みがロックエラーにならないことのテスト"""
+        wal_sql_manager.init_database()
+        errors = []
+
+        def write_votes(worker_id):
+            manager = SQLManager(temp_db, pragmas=WAL_TEST_PRAGMAS)
+            try:
+                manager.execute_many(
+                    INSERT_BLOCK_SQL,
+                    [
+                        (
+                            "poll1",
+                            f"voter{worker_id}_{i}",
+                            "yes",
+                            NOW,
+                            "0" * 64,
+                            i,
+                            f"hash{worker_id}_{i}",
+                        )
+                        for i in range(500)
+                    ],
+                )
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+            finally:
+                manager.close()
+
+        threads = [
+            threading.Thread(target=write_votes, args=(worker_id,))
+            for worker_id in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        result = wal_sql_manager.execute_query(
+            "SELECT COUNT(*) as count FROM blocks"
+        )
+        assert result[0]["count"] == 1000
+
+    def test_get_connection_reused(self, sql_manager):
+        """接続の再利用とcloseのテスト"""
+        conn = sql_manager.get_connection()
+        assert sql_manager.get_connection() is conn
+
+        sql_manager.close()
+        assert sql_manager.get_connection() is not conn
+
     def test_execute_script(self, sql_manager):
         """SQLスクリプト実行のテスト"""
         script = """
@@ -158,7 +301,7 @@ class TestSQLManager:
                 "poll1",
                 "voter1",
                 "yes",
-                datetime.now(timezone.utc),
+                NOW,
                 "0" * 64,
                 123,
                 "hash1",
@@ -167,7 +310,7 @@ class TestSQLManager:
                 "poll1",
                 "voter2",
                 "no",
-                datetime.now(timezone.utc),
+                NOW,
                 "hash1",
                 456,
                 "hash2",
@@ -176,21 +319,14 @@ class TestSQLManager:
                 "poll2",
                 "voter3",
                 "maybe",
-                datetime.now(timezone.utc),
+                NOW,
                 "0" * 64,
                 789,
                 "hash3",
             ),
         ]
 
-        for data in test_data:
-            sql_manager.execute_query(
-                """INSERT INTO blocks
-                   (poll_id, voter_hash, choice, timestamp, prev_hash,
-                    nonce, block_hash)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                data,
-            )
+        sql_manager.execute_many(INSERT_BLOCK_SQL, test_data)
 
         stats = sql_manager.get_database_stats()
 
@@ -208,12 +344,28 @@ class TestSQLManager:
         assert "latest_vote" in stats
         assert stats["latest_vote"] is not None
 
-    def test_backup_database(self, sql_manager, temp_db):
+    def test_get_database_stats_includes_wal(self, wal_sql_manager, temp_db):
+        """WALファイルのサイズもファイルサイズに含まれるテスト"""
+        wal_sql_manager.init_database()
+        wal_sql_manager.execute_many(
+            INSERT_BLOCK_SQL,
+            [("poll1", "voter1", "yes", NOW, "0" * 64, 1, "hash1")],
+        )
+
+        wal_size = os.path.getsize(f"{temp_db}-wal")
+        assert wal_size > 0
+
+        stats = wal_sql_manager.get_database_stats()
+        assert stats["file_size_bytes"] == (
+            os.path.getsize(temp_db) + wal_size
+        )
+
+    def test_backup_database(self, wal_sql_manager, temp_db):
         """データベースバックアップのテスト"""
-        sql_manager.init_database()
+        wal_sql_manager.init_database()
 
         # テストデータ挿入
-        sql_manager.execute_query(
+        wal_sql_manager.execute_query(
             """INSERT INTO blocks
                (poll_id, voter_hash, choice, timestamp, prev_hash,
                 nonce, block_hash)
@@ -222,7 +374,7 @@ class TestSQLManager:
                 "test_poll",
                 "voter123",
                 "yes",
-                datetime.now(timezone.utc),
+                NOW,
                 "0" * 64,
                 12345,
                 "block123",
@@ -230,7 +382,7 @@ class TestSQLManager:
         )
 
         # バックアップ作成
-        backup_path = sql_manager.backup_database()
+        backup_path = wal_sql_manager.backup_database()
 
         try:
             # バックアップファイルが存在するかチェック
@@ -242,31 +394,23 @@ class TestSQLManager:
                 "SELECT COUNT(*) as count FROM blocks"
             )
             assert result[0]["count"] == 1
+            backup_manager.close()
 
         finally:
             # バックアップファイルを削除
-            if os.path.exists(backup_path):
-                os.unlink(backup_path)
+            Path(backup_path).unlink(missing_ok=True)
 
     def test_verify_blockchain_integrity_valid(self, sql_manager):
         """ブロックチェーン整合性検証のテスト（正常ケース）"""
         sql_manager.init_database()
 
         # 正常なブロックチェーンデータを挿入
-        now = datetime.now(timezone.utc)
         test_data = [
-            ("poll1", "voter1", "yes", now, "0" * 64, 123, "hash1"),
-            ("poll1", "voter2", "no", now, "hash1", 456, "hash2"),
+            ("poll1", "voter1", "yes", NOW, "0" * 64, 123, "hash1"),
+            ("poll1", "voter2", "no", NOW, "hash1", 456, "hash2"),
         ]
 
-        for data in test_data:
-            sql_manager.execute_query(
-                """INSERT INTO blocks
-                   (poll_id, voter_hash, choice, timestamp, prev_hash,
-                    nonce, block_hash)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                data,
-            )
+        sql_manager.execute_many(INSERT_BLOCK_SQL, test_data)
 
         is_valid, errors = sql_manager.verify_blockchain_integrity()
 
@@ -278,116 +422,154 @@ class TestSQLManager:
         sql_manager.init_database()
 
         # 不正なブロックチェーンデータを挿入（前ハッシュが一致しない）
-        now = datetime.now(timezone.utc)
         test_data = [
-            ("poll1", "voter1", "yes", now, "0" * 64, 123, "hash1"),
+            ("poll1", "voter1", "yes", NOW, "0" * 64, 123, "hash1"),
             (
                 "poll1",
                 "voter2",
                 "no",
-                now,
+                NOW,
                 "invalid_hash",
                 456,
                 "hash2",
             ),  # 不正な前ハッシュ
         ]
 
-        for data in test_data:
-            sql_manager.execute_query(
-                """INSERT INTO blocks
-                   (poll_id, voter_hash, choice, timestamp, prev_hash,
-                    nonce, block_hash)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                data,
-            )
+        sql_manager.execute_many(INSERT_BLOCK_SQL, test_data)
 
         is_valid, errors = sql_manager.verify_blockchain_integrity()
 
         assert is_valid is False
         assert len(errors) > 0
 
-    def test_get_vote_statistics_general(self, sql_manager):
-        """投票統計取得のテスト（全体統計）"""
+    def test_verify_blockchain_integrity_large(self, sql_manager):
+        """長いチェーンを全件読み込まずに検証するテスト"""
         sql_manager.init_database()
 
-        # テストデータ挿入
-        now = datetime.now(timezone.utc)
-        test_data = [
-            ("poll1", "voter1", "yes", now, "0" * 64, 123, "hash1"),
-            ("poll1", "voter2", "yes", now, "hash1", 456, "hash2"),
-            ("poll1", "voter3", "no", now, "hash2", 789, "hash3"),
-            ("poll2", "voter4", "maybe", now, "0" * 64, 111, "hash4"),
-        ]
-
-        for data in test_data:
-            sql_manager.execute_query(
-                """INSERT INTO blocks
-                   (poll_id, voter_hash, choice, timestamp, prev_hash,
-                    nonce, block_hash)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                data,
-            )
-
-        stats = sql_manager.get_vote_statistics()
+        def extend_chain(start, stop, prev_hash):
+            """正常なチェーンにブロックを追加し、末尾のハッシュを返す"""
+            test_data = []
+            for i in range(start, stop):
+                block_hash = f"{i:064x}"
+                test_data.append(
+                    (
+                        "poll1",
+                        f"voter{i}",
+                        "yes",
+                        NOW,
+                        prev_hash,
+                        i,
+                        block_hash,
+                    )
+                )
+                prev_hash = block_hash
+            sql_manager.execute_many(INSERT_BLOCK_SQL, test_data)
+            return prev_hash
+
+        def verify_peak():
+            """整合性を検証し、その間のピークメモリを返す"""
+            tracemalloc.start()
+            try:
+                is_valid, errors = sql_manager.verify_blockchain_integrity()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            assert is_valid is True
+            assert errors == []
+            return peak
+
+        prev_hash = extend_chain(0, 1000, "0" * 64)
+        small_peak = verify_peak()
+
+        # ブロック数を10倍にしてから再検証
+        extend_chain(1000, 10000, prev_hash)
+        large_peak = verify_peak()
+
+        # 全行をリスト化するとピークはブロック数に比例して約10倍になる。
+        # 逐次処理ならほぼ一定なので、内部キャッシュ等の揺れ分の余裕を
+        # 加えても比例より十分小さく収まる
+        assert large_peak < small_peak * 3 + 64 * 1024
+
+    @pytest.fixture(scope="class")
+    def stats_manager(self, tmp_path_factory):
+        """投票統計テスト用に一度だけデータを投入したSQLManagerを作成"""
+        db_path = tmp_path_factory.mktemp("stats") / "stats.db"
+        manager = SQLManager(str(db_path), pragmas=FAST_TEST_PRAGMAS)
+        manager.init_database()
+        manager.bulk_insert_blocks(
+            [
+                ("poll1", "voter1", "yes", NOW, "0" * 64, 123, "hash1"),
+                ("poll1", "voter2", "yes", NOW, "hash1", 456, "hash2"),
+                ("poll1", "voter3", "no", NOW, "hash2", 789, "hash3"),
+                ("poll2", "voter4", "maybe", NOW, "0" * 64, 111, "hash4"),
+            ]
+        )
+        yield manager
+        manager.close()
+
+    @pytest.mark.parametrize(
+        "poll_id,expected_total,expected_choices,yes_percentage",
+        [
+            (None, 4, 3, 50.0),  # 全体統計: yes, no, maybe
+            ("poll1", 3, 2, 66.67),  # 特定投票ID: yes, no
+        ],
+        ids=["general", "specific_poll"],
+    )
+    def test_get_vote_statistics(
+        self,
+        stats_manager,
+        poll_id,
+        expected_total,
+        expected_choices,
+        yes_percentage,
+    ):
+        """投票統計取得のテスト"""
+        stats = stats_manager.get_vote_statistics(poll_id)
 
         # 基本統計をチェック
-        assert stats["total_votes"] == 4
+        assert stats["total_votes"] == expected_total
 
         # 選択肢分布をチェック
         choice_dist = stats["choice_distribution"]
-        assert len(choice_dist) == 3  # yes, no, maybe
+        assert len(choice_dist) == expected_choices
 
         # yesが最多（2票）であることをチェック
-        yes_votes = next(
-            item for item in choice_dist if item["choice"] == "yes"
-        )
-        assert yes_votes["count"] == 2
-        assert yes_votes["percentage"] == 50.0
+        assert choice_dist[0]["choice"] == "yes"
+        assert choice_dist[0]["count"] == 2
+        assert choice_dist[0]["percentage"] == yes_percentage
 
-    def test_get_vote_statistics_specific_poll(self, sql_manager):
-        """投票統計取得のテスト（特定投票ID）"""
+    def test_get_vote_statistics_quoted_poll_id(self, sql_manager):
+        """引用符を含む投票IDがSQLとして解釈されないことのテスト"""
         sql_manager.init_database()
 
-        # テストデータ挿入
-        now = datetime.now(timezone.utc)
-        test_data = [
-            ("poll1", "voter1", "yes", now, "0" * 64, 123, "hash1"),
-            ("poll1", "voter2", "no", now, "hash1", 456, "hash2"),
-            ("poll2", "voter3", "maybe", now, "0" * 64, 789, "hash3"),
-        ]
-
-        for data in test_data:
-            sql_manager.execute_query(
-                """INSERT INTO blocks
-                   (poll_id, voter_hash, choice, timestamp, prev_hash,
-                    nonce, block_hash)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                data,
-            )
+        sql_manager.execute_query(
+            """INSERT INTO blocks
+               (poll_id, voter_hash, choice, timestamp, prev_hash,
+                nonce, block_hash)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            ("poll1", "voter1", "yes", NOW, "0" * 64, 123, "hash1"),
+        )
 
-        # poll1の統計を取得
-        stats = sql_manager.get_vote_statistics("poll1")
+        stats = sql_manager.get_vote_statistics("x' OR '1'='1")
 
-        assert stats["total_votes"] == 2
-        assert len(stats["choice_distribution"]) == 2  # yes, no
+        assert stats["total_votes"] == 0
+        assert stats["choice_distribution"] == []
 
     def test_execute_file_not_found(self, sql_manager):
         """存在しないSQLファイル実行のテスト"""
         with pytest.raises(FileNotFoundError):
             sql_manager.execute_file("nonexistent.sql")
 
-    @patch("builtins.open")
-    def test_execute_file_success(self, mock_open, sql_manager):
+    def test_execute_file_success(self, sql_manager, tmp_path):
         """SQLファイル実行成功のテスト"""
-        # ファイル内容をモック
-        mock_open.return_value.__enter__.return_value.read.return_value = """
-        CREATE TABLE test_file (id INTEGER);
-        INSERT INTO test_file VALUES (1);
-        """
+        sql_file = tmp_path / "test.sql"
+        sql_file.write_text(
+            "CREATE TABLE test_file (id INTEGER);\n"
+            "INSERT INTO test_file VALUES (1);\n",
+            encoding="utf-8",
+        )
 
-        # パス存在チェックをモック
-        with patch("pathlib.Path.exists", return_value=True):
-            sql_manager.execute_file("test.sql")
+        sql_manager.execute_file(str(sql_file))
 
         # テーブルが作成されたかチェック
         result = sql_manager.execute_query(
@@ -401,11 +583,11 @@ class TestSQLManager:
         with pytest.raises(FileNotFoundError):
             sql_manager.restore_database("nonexistent_backup.db")
 
-    def test_restore_database_success(self, sql_manager, temp_db):
+    def test_restore_database_success(self, wal_sql_manager, temp_db):
         """データベース復元成功のテスト"""
         # 元のデータベースを初期化してデータを挿入
-        sql_manager.init_database()
-        sql_manager.execute_query(
+        wal_sql_manager.init_database()
+        wal_sql_manager.execute_query(
             """INSERT INTO blocks
                (poll_id, voter_hash, choice, timestamp, prev_hash,
                 nonce, block_hash)
@@ -414,7 +596,7 @@ class TestSQLManager:
                 "original_poll",
                 "voter123",
                 "yes",
-                datetime.now(timezone.utc),
+                NOW,
                 "0" * 64,
                 12345,
                 "original_hash",
@@ -422,28 +604,27 @@ class TestSQLManager:
         )
 
         # バックアップ作成
-        backup_path = sql_manager.backup_database()
+        backup_path = wal_sql_manager.backup_database()
 
         try:
             # データベースを初期化して空にする
-            sql_manager.init_database()
-            result = sql_manager.execute_query(
+            wal_sql_manager.init_database()
+            result = wal_sql_manager.execute_query(
                 "SELECT COUNT(*) as count FROM blocks"
             )
             assert result[0]["count"] == 0
 
             # バックアップから復元
-            sql_manager.restore_database(backup_path)
+            wal_sql_manager.restore_database(backup_path)
 
             # データが復元されたかチェック
-            result = sql_manager.execute_query("SELECT * FROM blocks")
+            result = wal_sql_manager.execute_query("SELECT * FROM blocks")
             assert len(result) == 1
             assert result[0]["poll_id"] == "original_poll"
 
         finally:
             # バックアップファイルを削除
-            if os.path.exists(backup_path):
-                os.unlink(backup_path)
+            Path(backup_path).unlink(missing_ok=True)
 
 
 class TestSQLManagerIntegration:
@@ -459,19 +640,18 @@ class TestSQLManagerIntegration:
 
     def test_full_workflow(self, temp_db):
         """完全なワークフローのテスト"""
-        sql_manager = SQLManager(temp_db)
+        sql_manager = SQLManager(temp_db, pragmas=WAL_TEST_PRAGMAS)
 
         # 1. データベース初期化
         sql_manager.init_database()
 
         # 2. テストデータ挿入
-        now = datetime.now(timezone.utc)
         test_votes = [
             (
                 "election_2024",
                 "voter_alice",
                 "candidate_a",
-                now,
+                NOW,
                 "0" * 64,
                 100000,
                 "hash_001",
@@ -480,7 +660,7 @@ class TestSQLManagerIntegration:
                 "election_2024",
                 "voter_bob",
                 "candidate_b",
-                now,
+                NOW,
                 "hash_001",
                 250000,
                 "hash_002",
@@ -489,21 +669,14 @@ class TestSQLManagerIntegration:
                 "election_2024",
                 "voter_charlie",
                 "candidate_a",
-                now,
+                NOW,
                 "hash_002",
                 180000,
                 "hash_003",
             ),
         ]
 
-        for vote in test_votes:
-            sql_manager.execute_query(
-                """INSERT INTO blocks
-                   (poll_id, voter_hash, choice, timestamp, prev_hash,
-                    nonce, block_hash)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                vote,
-            )
+        sql_manager.bulk_insert_blocks(test_votes)
 
         # 3. 統計情報取得
         stats = sql_manager.get_database_stats()
@@ -533,8 +706,8 @@ class TestSQLManagerIntegration:
             assert result[0]["count"] == 3
 
         finally:
-            if os.path.exists(backup_path):
-                os.unlink(backup_path)
+            sql_manager.close()
+            Path(backup_path).unlink(missing_ok=True)
 
 
 def test_get_sql_manager():